@@ -5,69 +5,381 @@ Description: This file manages the creation of and updating of the display and o
     on the SSD1306 OLED display. It accepts data from the main module and displays it on screen.
 
 Created on: 11-DEC-2023
-Updated on: 15-DEC-2023
+Updated on: 15-OCT-2026
 """
 
 
-from machine import Pin, I2C
+import micropython
+from micropython import const
+from machine import Pin, I2C, mem32
 from ssd1306 import SSD1306_I2C
 
+# rp2.DMA is only available on MicroPython 1.22 and newer. Older firmware falls back to blocking
+# display writes.
+try:
+    from rp2 import DMA
+except ImportError:
+    DMA = None
+
+
+# Pins, bus frequency, and size of the OLED display.
+_SDA_PIN            = const(14)
+_SCL_PIN            = const(15)
+_I2C_FREQ           = const(400000)
+_WIDTH              = const(128)
+_HEIGHT             = const(64)
+
+# RP2040 I2C1 registers and DMA request line used to stream data to the display in the background.
+_I2C1_BASE          = const(0x40048000)
+_IC_TAR             = const(_I2C1_BASE + 0x04)
+_IC_DATA_CMD        = const(_I2C1_BASE + 0x10)
+_IC_RAW_INTR_STAT   = const(_I2C1_BASE + 0x34)
+_IC_CLR_TX_ABRT     = const(_I2C1_BASE + 0x54)
+_IC_ENABLE          = const(_I2C1_BASE + 0x6c)
+_IC_STATUS          = const(_I2C1_BASE + 0x70)
+_DREQ_I2C1_TX       = const(34)
+
+
+@micropython.viper
+def _fill_tx_words(words, data, length: int) -> int:
+    """ Expands display data into the 16 bit words written to the I2C DATA_CMD register.
+
+    Params
+    -----
+    words [bytearray, required] Buffer receiving the words. Must hold at least length + 1 words.
+    data [buffer, required] Bytes to send to the display's GDDRAM.
+    length [int, required] Number of bytes in data.
+
+    Returns
+    -----
+    The number of words to transfer, including the leading 0x40 data control byte.
+    """
+
+    dst = ptr16(words)
+    src = ptr8(data)
+
+    # The 0x40 control byte marks the rest of the transaction as display data and the STOP bit on
+    # the last word ends the transaction.
+    dst[0] = 0x40
+    for i in range(length):
+        dst[i + 1] = src[i]
+    dst[length] = dst[length] | 0x200
+
+    return length + 1
+
+
+class FastSSD1306(SSD1306_I2C):
+    """ SSD1306 I2C driver which can refresh a subset of the display's pages instead of the
+    whole framebuffer. When the display is on the hardware I2C bus 1 and DMA is available, display
+    data is sent by DMA so the caller doesn't block while it is transferred. """
+
+    def __init__(self, width: int, height: int, i2c: I2C, addr: int = 0x3c,
+                 external_vcc: bool = False, i2c1_dma: bool = False):
+        """ Sets up the transmit buffers and initializes the display.
+
+        Params
+        -----
+        width [int, required] Width of the display in pixels.
+        height [int, required] Height of the display in pixels.
+        i2c [I2C, required] I2C bus the display is connected to.
+        addr [int, optional] I2C address of the display.
+        external_vcc [bool, optional] Whether the display is powered by an external supply.
+        i2c1_dma [bool, optional] Set when i2c is the hardware I2C bus 1 to send display data to it
+            by DMA. The DMA writes straight to the I2C1 registers, so any other bus, including a
+            SoftI2C, must use the blocking writes.
+        """
+
+        # The DMA channel and transmit buffers need to exist before the parent class initializes
+        # and clears the display. Without DMA, a buffer holding the 0x40 data control byte followed
+        # by the data is allocated once so that writes don't allocate a new one each time.
+        self.dma = DMA() if i2c1_dma and DMA is not None else None
+        if self.dma is not None:
+            self.tx_words = bytearray(2 * (width * height // 8 + 1))
+        else:
+            self.tx_buf = bytearray(width * height // 8 + 1)
+            self.tx_buf[0] = 0x40
+            self.tx_mv = memoryview(self.tx_buf)
+
+        # Pages being sent in the background, and pages which need to be sent again because their
+        # last write failed. -1 means there are none.
+        self.sending_first_page, self.sending_last_page = -1, -1
+        self.dirty_first_page, self.dirty_last_page = -1, -1
+
+        super().__init__(width, height, i2c, addr, external_vcc)
+
+    def mark_dirty(self, first_page: int, last_page: int) -> None:
+        """ Records a range of pages which need to be sent again by the next show_pages call.
+
+        Params
+        -----
+        first_page [int, required] Index of the first page to send again.
+        last_page [int, required] Index of the last page to send again (inclusive).
+        """
+
+        if self.dirty_first_page < 0 or first_page < self.dirty_first_page:
+            self.dirty_first_page = first_page
+        if last_page > self.dirty_last_page:
+            self.dirty_last_page = last_page
+
+    def has_dirty_pages(self) -> bool:
+        """ Returns whether any pages need to be sent again because their last write failed. """
+
+        self.wait_for_write()
+        return self.dirty_first_page >= 0
+
+    def show_dirty_pages(self) -> None:
+        """ Sends any pages again whose last write failed. """
+
+        if self.has_dirty_pages():
+            self.show_pages(self.dirty_first_page, self.dirty_last_page)
+
+    def wait_for_write(self) -> None:
+        """ Blocks until any display data being sent in the background has been transferred. """
+
+        if self.dma is None:
+            return
+
+        # Wait for the DMA to hand all of the data to the I2C peripheral. If the display didn't
+        # acknowledge the transfer, the I2C peripheral stops accepting data so cancel the DMA.
+        while self.dma.active():
+            if mem32[_IC_RAW_INTR_STAT] & 0x40:
+                self.dma.active(0)
+                break
+
+        # Wait for the I2C transmit FIFO to drain and the bus to go idle.
+        while mem32[_IC_STATUS] & 0x5 != 0x4:
+            pass
+
+        # If the transfer was aborted, the pages being sent didn't make it to the display and its
+        # write position was left partway through the address window. Mark the pages to be sent
+        # again and forget the window to have the next write set it again. Then clear the abort so
+        # the blocking driver writes aren't affected by it.
+        if mem32[_IC_RAW_INTR_STAT] & 0x40:
+            if self.sending_first_page >= 0:
+                self.mark_dirty(self.sending_first_page, self.sending_last_page)
+            self.window_first_page = -1
+            mem32[_IC_CLR_TX_ABRT]
+        self.sending_first_page, self.sending_last_page = -1, -1
+
+    def write_cmd(self, cmd: int) -> None:
+        """ Sends a command byte to the display once any background data transfer has finished.
+
+        Params
+        -----
+        cmd [int, required] Command byte to send.
+        """
+
+        self.wait_for_write()
+        super().write_cmd(cmd)
+
+    def write_data(self, buf) -> None:
+        """ Sends data bytes to the display in a single I2C transaction, regardless of how the
+        installed driver splits up its writes. When DMA is available the transfer is started in
+        the background and this returns immediately.
+
+        Params
+        -----
+        buf [buffer, required] Bytes to write to the display's GDDRAM.
+        """
+
+        self.wait_for_write()
+
+        # Without DMA, copy the data in behind the 0x40 data control byte and send it in one
+        # blocking transaction.
+        if self.dma is None:
+            length = len(buf) + 1
+            self.tx_mv[1:length] = buf
+            self.i2c.writeto(self.addr, self.tx_mv[:length])
+            return
+
+        count = _fill_tx_words(self.tx_words, buf, len(buf))
+
+        # Point the I2C peripheral at the display. The target address can only be changed while
+        # the peripheral is disabled.
+        mem32[_IC_ENABLE] = 0
+        mem32[_IC_TAR] = self.addr
+        mem32[_IC_ENABLE] = 1
+
+        # Feed the words to the DATA_CMD register as the transmit FIFO requests them.
+        ctrl = self.dma.pack_ctrl(size=1, inc_write=False, treq_sel=_DREQ_I2C1_TX)
+        self.dma.config(read=self.tx_words, write=_IC_DATA_CMD, count=count,
+                        ctrl=ctrl, trigger=True)
+
+    def init_display(self) -> None:
+        """ Initializes the display, forgetting the address window set on it. """
+
+        # The window is set again by the first write, which happens as part of the initialization.
+        # The framebuffer view used to slice out the pages to send is also created once here, as
+        # the framebuffer exists by now and the initialization writes to the display.
+        self.window_first_page = -1
+        self.window_last_page = -1
+        self.buffer_mv = memoryview(self.buffer)
+        super().init_display()
+
+    def show(self) -> None:
+        """ Sends the whole framebuffer to the display. """
+
+        self.show_pages(0, self.pages - 1)
+
+    def show_pages(self, first_page: int, last_page: int) -> None:
+        """ Sends the framebuffer rows for a range of pages to the display.
+
+        Params
+        -----
+        first_page [int, required] Index of the first 8 pixel tall page to send.
+        last_page [int, required] Index of the last 8 pixel tall page to send (inclusive).
+        """
+
+        # Finish any background transfer first, as an aborted one forgets the window and marks its
+        # pages to be sent again. Any pages whose last write failed are sent along with these.
+        self.wait_for_write()
+        if self.dirty_first_page >= 0:
+            first_page = min(first_page, self.dirty_first_page)
+            last_page = max(last_page, self.dirty_last_page)
+            self.dirty_first_page, self.dirty_last_page = -1, -1
+        self.sending_first_page, self.sending_last_page = first_page, last_page
+
+        try:
+            self._show_pages(first_page, last_page)
+        except OSError:
+            # A write failed partway through, leaving the pages unsent and the display's write
+            # position unknown. Mark the pages to be sent again and forget the window so that the
+            # next refresh sets it again.
+            self.mark_dirty(first_page, last_page)
+            self.sending_first_page, self.sending_last_page = -1, -1
+            self.window_first_page = -1
+            raise
+
+    def _show_pages(self, first_page: int, last_page: int) -> None:
+        """ Sets the address window if needed and writes the pages in it. See show_pages. """
+
+        # In horizontal addressing mode, the display's write position wraps back to the start of the
+        # address window once the whole window has been written. The window therefore only needs
+        # to be set when it changes rather than before every write.
+        if first_page != self.window_first_page or last_page != self.window_last_page:
+            # The first write after initialization sets horizontal addressing mode and a column
+            # window spanning the full width, which every write uses.
+            if self.window_first_page < 0:
+                self.write_cmd(0x20)
+                self.write_cmd(0x00)
+                self.write_cmd(0x21)
+                self.write_cmd(0)
+                self.write_cmd(self.width - 1)
+
+            self.write_cmd(0x22)
+            self.write_cmd(first_page)
+            self.write_cmd(last_page)
+            self.window_first_page = first_page
+            self.window_last_page = last_page
+
+        # Write only the bytes inside of the window.
+        self.write_data(self.buffer_mv[first_page * self.width:(last_page + 1) * self.width])
+
 
 class Display:
     """ A class to manage the output of data from the main module. """
 
-    def __init__(self):
+    # Label and value format of each row of text, from the top of the display down. The values
+    # passed to update are drawn in the same order.
+    ROWS = (("S1 = ", "%d"),
+            ("S2 = ", "%d"),
+            ("Avg. = ", "%d"),
+            ("R delta = ", "%d"),
+            ("% delta = ", "%.2f"),
+            ("Valid = ", "%s"),
+            ("Temp. F = ", "%.1f"),
+            ("Humidity = ", "%d%%"))
+
+    def __init__(self, i2c_freq: int = _I2C_FREQ):
+        """ Sets up the I2C bus and OLED display, then draws the initial screen.
+
+        Params
+        -----
+        i2c_freq [int, optional] Clock frequency of the I2C bus in Hz. The SSD1306 is rated for
+            400 kHz fast-mode and most panels handle 1 MHz. Lower it for setups with long wires.
+        """
+
         # Setup the oled display
         self.display = None
-        _sda_pin = Pin(14, Pin.OUT)
-        _scl_pin = Pin(15, Pin.OUT)
-        _i2c = I2C(1, sda=_sda_pin, scl=_scl_pin, freq=100000)
-        self.display = SSD1306_I2C(128, 64, _i2c)
-
-        # Initialize display text values and update the display.
-        self.val1_base_text         = "S1 = "
-        self.val2_base_text         = "S2 = "
-        self.avg_base_text          = "Avg. = "
-        self.raw_delta_base_text    = "R delta = "
-        self.perc_delta_base_text   = "% delta = "
-        self.is_valid_base_text     = "Valid = "
-        self.temp_base_text         = "Temp. F = "
-        self.humidity_base_text     = "Humidity = "
+        _sda_pin = Pin(_SDA_PIN, Pin.OUT)
+        _scl_pin = Pin(_SCL_PIN, Pin.OUT)
+        _i2c = I2C(1, sda=_sda_pin, scl=_scl_pin, freq=i2c_freq)
+        self.display = FastSSD1306(_WIDTH, _HEIGHT, _i2c, i2c1_dma=True)
+
+        # The labels never change, so draw them once here. Updates only redraw the values, which
+        # start at the column just after their label.
+        self.value_columns = []
+        for page, (label, fmt) in enumerate(self.ROWS):
+            self.display.text(label, 0, page * 8)
+            self.value_columns.append(len(label) * 8)
+
+        # Value text last drawn on each row. None forces the first update to redraw every row.
+        self.last_rows = [None] * len(self.ROWS)
+
+        # Inputs given to the last update. None forces the first update to run.
+        self.last_key = None
 
         # Update the text shown on the screen.
         self.update()
 
-    def update(self, val1: int = -1, val2: int  = -1, avg: float  = -1.0,
+    def update(self, val1: int = -1, val2: int  = -1, avg: int  = -1,
                        raw_delta: int = -1, perc_delta: float = -1.0,
                        is_valid: bool = False,
-                       temp_f: float = -1.0, rel_hum: float = -1.0) -> None:
+                       temp_f: float = -1.0, rel_hum: int = -1) -> None:
         """ Refreshes the display, setting the available text. 
         
         Params
         -----
         val1 [int, optional] LDR value taken from the first sensor.
         val2 [int, optional] LDR value taken from the second sensor.
-        avg [float, optional] Average of the two LDR values.
+        avg [int, optional] Average of the two LDR values.
         raw_delta [int, optional] Absolute value of the difference between the two values.
         perc_delta [float, optional] Difference between the LDR values as a percentage.
         is_valid [bool, optional] Indicates whether the perc_delta is within an acceptable range.
         temp_f [float, optional] Temperature in degrees fahrenheit.
-        rel_hum [float, optional] Relative humidity as a percentage out of 100.
+        rel_hum [int, optional] Relative humidity as a percentage out of 100.
         """
 
-        # Fill the screen with black pixels and set the display text. Lastly, call the show method.
-        self.display.fill(0)
+        # The display methods and row caches are bound to locals to avoid repeated attribute lookups.
+        display = self.display
+
+        # Skip the refresh entirely if none of the inputs have changed since the last update and
+        # every page made it to the display. Floats are rounded so that tiny amounts of noise don't
+        # trigger a refresh.
+        key = (val1, val2, avg, raw_delta, is_valid, round(perc_delta, 2), round(temp_f, 1),
+               rel_hum)
+        if key == self.last_key and not display.has_dirty_pages():
+            return
+        self.last_key = key
+
+        fill_rect, text = display.fill_rect, display.text
+        last_rows, value_columns = self.last_rows, self.value_columns
+
+        # Format the value for each row and redraw only the values which changed, keeping track of
+        # the first and last changed page. Each row is 8 pixels tall so the row index is also its
+        # page index.
+        values = (val1, val2, avg, raw_delta, perc_delta, is_valid, temp_f, rel_hum)
+        first_page, last_page = -1, -1
+        for page, (label, fmt) in enumerate(self.ROWS):
+            value = fmt % values[page]
+            if value == last_rows[page]:
+                continue
+
+            x, y = value_columns[page], page * 8
+            fill_rect(x, y, _WIDTH - x, 8, 0)
+            text(value, x, y)
+            last_rows[page] = value
 
-        self.display.text(f"{self.val1_base_text}{val1}", 0, 0)
-        self.display.text(f"{self.val2_base_text}{val2}", 0, 8)
-        self.display.text(f"{self.avg_base_text}{avg}", 0, 16)
-        self.display.text(f"{self.raw_delta_base_text}{raw_delta}", 0, 24)
-        self.display.text(f"{self.perc_delta_base_text}{perc_delta}", 0, 32)
-        self.display.text(f"{self.is_valid_base_text}{is_valid}", 0, 40)
-        self.display.text(f"{self.temp_base_text}{temp_f}", 0, 48)
-        self.display.text(f"{self.humidity_base_text}{rel_hum}%", 0, 56)
+            if first_page < 0:
+                first_page = page
+            last_page = page
 
-        self.display.show()
+        # Only send the changed pages to the display, if there are any. Otherwise, send any pages
+        # again whose last write failed.
+        if first_page >= 0:
+            display.show_pages(first_page, last_page)
+        else:
+            display.show_dirty_pages()
 
 
 def main():
@@ -75,7 +387,7 @@ def main():
 
     # Create a test display and attempt to update it with fake data.
     display = Display()
-    display.update(00000, 00000, 0.0, 0, 0.0, False, 0.0, 0.0)
+    display.update(00000, 00000, 0, 0, 0.0, False, 0.0, 0)
 
 
 if __name__ == "__main__":
@@ -7,37 +7,42 @@ Description: Main module and controller for the Light Intensity System used to m
     Pico.
 
 Created on: 10-DEC-2023
-Updated on: 12-DEC-2023
+Updated on: 15-OCT-2026
 """
 
 
-from machine import Pin, ADC
+import gc
+import micropython
+from micropython import const
+from machine import Pin, ADC, freq
 from dht import DHT11
 from utime import sleep_ms
 from sys import exit
-from _thread import start_new_thread
+from _thread import start_new_thread, allocate_lock
 from display import Display
 
 
-def read_ldr_vals(sensor1: ADC, sensor2: ADC) -> list:
-    """ Take a reading from each LDR and return a list of individual readings. 
-        
-    Params
-    -----
-    sensor1 [ADC, required] ADC pin the first LDR sensor is connected to.
-    sensor2 [ADC, required] ADC pin the second LDR sensor is connected to.
+# Pins the LDR sensors, DHT11 sensor, and reading indicator LED (the onboard LED) are connected to.
+_LDR1_PIN       = const(26)
+_LDR2_PIN       = const(27)
+_DHT_PIN        = const(12)
+_LED_PIN        = const(25)
 
-    Returns
-    -----
-    A list of integer values taken from the LDR sensors.
-    """
+# Set the CPU clock in Hz here. The Pico boots at 125 MHz but runs reliably at 200 MHz, which
+# speeds up the interpreter roughly in proportion.
+_CPU_FREQ       = const(200000000)
 
-    return [sensor1.read_u16(), sensor2.read_u16()]
+# Adjust the delay between readings and indicator LED ontime (both in ms) here. The DHT11 is
+# sampled every reading or every two seconds, whichever is longer, so the reading delay can go as
+# low as about 100.
+_READ_DELAY_MS  = const(15000)
+_LED_ON_MS      = const(125)
 
 
+@micropython.viper
 def calculate_delta(val1: int, val2: int) -> int:
-    """ Calculate the difference between the provided LDR values. 
-        
+    """ Calculate the difference between the provided LDR values using machine integers.
+
     Params
     -----
     val1 [int, required] LDR value taken from the first sensor.
@@ -49,46 +54,42 @@ def calculate_delta(val1: int, val2: int) -> int:
         delta = |val1 - val2|
     """
 
-    return abs(val1 - val2)
+    delta = val1 - val2
+    return delta if delta >= 0 else -delta
 
 
-def calculate_percent_delta(val1: int, val2: int, avg_val: float, raw_delta: int) -> float:
-    """ Calculate the percent difference between given values. This method is semi-optimized
-    to only perform part of the procedure for finding percent delta as the other parts are taken
-    care of elsewhere in the module. In its current state, it does not use the val1 nor val2 inputs
-    so they could technically be removed, but leaving them in makes the code more readable so the
-    decision was made to keep them.
-    
-    Params
-    -----
-    val1 [int, required] LDR value taken from the first sensor.
-    val2 [int, required] LDR value taken from the second sensor.
-    avg_val [float, required] Average of the two LDR values.
-    raw_delta [int, required] Absolute value of the difference between the two values.
-
-    Returns
-    -----
-    A float calculated using the percent difference formula
-        % delta = (|v1 - v1| / [(v1 + v2) / 2]) * 100
-    """
-
-    return round(((raw_delta / avg_val) * 100.0), 2)
-
-
-def calculate_average_val(val1: int, val2: int) -> float:
-    """ Calculate the average value between the two LDR input values.
+@micropython.native
+def process_ldr_vals(val1: int, val2: int, max_perc_delta: float) -> tuple:
+    """ Calculate the average, raw delta, and percent delta values for a pair of LDR readings and
+    check the data's validity. Compiled to native code to skip the bytecode interpreter.
 
     Params
     -----
     val1 [int, required] LDR value taken from the first sensor.
     val2 [int, required] LDR value taken from the second sensor.
+    max_perc_delta [float, required] Maximum allowed % delta. Values above this are invalid while
+        those equal or less than are valid.
 
     Returns
     -----
-    A float calculated by dividing the sum of the values by two.
+    A tuple of the average, raw delta, percent delta, and validity of the readings where
+        % delta = (|v1 - v2| / [(v1 + v2) / 2]) * 100 = 200 * |v1 - v2| / (v1 + v2)
     """
 
-    return round((val1 + val2) / 2.0)
+    total = val1 + val2
+    avg_val = round(total / 2.0)
+    delta = calculate_delta(val1, val2)
+
+    # Percent delta is calculated in hundredths of a percent using integer division, which is much
+    # cheaper than float division on the Pico as it has no FPU. The division is split in two so
+    # that no intermediate value leaves the small integer range and allocates a big integer. Both
+    # LDRs read 0 in full darkness, in which case there is no difference between them.
+    if total:
+        quotient, remainder = divmod(delta * 200, total)
+        perc_delta = (quotient * 100 + remainder * 100 // total) / 100
+    else:
+        perc_delta = 0.0
+    return avg_val, delta, perc_delta, perc_delta <= max_perc_delta
 
 
 def print_data(val1: int, val2: int, raw_delta: int, perc_delta: float) -> None:
@@ -109,46 +110,10 @@ def print_data(val1: int, val2: int, raw_delta: int, perc_delta: float) -> None:
     print(f"LDR1 {val1}\tLDR2 {val2}\tDelta {raw_delta}\tPercentage Delta {perc_delta}")
 
 
-def is_data_valid(perc_delta: float, max_perc_delta: float = 10.0) -> bool:
-    """ Verifies that a set of LDR values are valid by checking that the percent delta between
-    them is less than 10%.
-    
-    Params
-    -----
-    perc_delta [float, required] % delta value calculated from most recent data refresh.
-    max_perc_delta [float, optional] Maximum allowed % delta. Values above this are invalid while
-    those equal or less than are valid.
-
-    Returns
-    -----
-    Boolean indicating whether the given perc_delta is valid or not.
-    """
-
-    return perc_delta <= max_perc_delta
-
-
-class RunCoreFlag:
-    """ This class holds the flag which indicates that a reading has taken place. """
-
-    run_core = False
-
-    @classmethod
-    def set_run_flag(cls):
-        """ Set the run core flag to True. """
-
-        cls.run_core = True
-
-    @classmethod
-    def clear_run_flag(cls):
-        """ Clear the run core flag by setting it to False. """
-
-        cls.run_core = False
-
-    @classmethod
-    def get_run_flag(cls):
-        """ Return the run core flag. """
-
-        return cls.run_core
+# Lock used to signal core 1 that a reading has taken place. It is held while there is no reading
+# to indicate; core 0 releases it after a reading and core 1 blocks acquiring it until then.
+run_core_lock = allocate_lock()
+run_core_lock.acquire()
 
 
 def core0_thread(reading_delay_ms: int, max_perc_delta: float, verbose_output: bool) -> None:
@@ -166,78 +131,84 @@ def core0_thread(reading_delay_ms: int, max_perc_delta: float, verbose_output: b
     try:
         # Setup the display, ADC pins needed to run the LDR sensors, and the DHT11 sensor.
         display = Display()
-        ldr1, ldr2 = ADC(26), ADC(27)
-        dht = DHT11(Pin(12))
+        ldr1, ldr2 = ADC(_LDR1_PIN), ADC(_LDR2_PIN)
+        dht = DHT11(Pin(_DHT_PIN))
     except ValueError:  # LDR was likely plugged into an invalid ADC pin.
         print("Unable to setup display/sensors.")
+        exit(1)
+
+    # Bind the methods called on every reading to locals to avoid repeated attribute lookups.
+    read_ldr1, read_ldr2 = ldr1.read_u16, ldr2.read_u16
+    process = process_ldr_vals
+    measure, temperature, humidity = dht.measure, dht.temperature, dht.humidity
+    update_display, sleep = display.update, sleep_ms
+    run_core_locked, release_run_core = run_core_lock.locked, run_core_lock.release
+
+    # The DHT11 can only take a measurement about once a second and blocks while doing so. Sample
+    # it every dht_interval readings, rounded up so that at least two seconds pass between samples,
+    # and reuse the values in between.
+    dht_interval = (2000 + reading_delay_ms - 1) // reading_delay_ms
+    dht_countdown = 0
+
+    # Automatic garbage collection is disabled so that it can't pause a sensor read or display
+    # write. Each reading allocates little enough that collecting once per loop is enough.
+    collect = gc.collect
+    gc.disable()
 
     # Loop until device loses power.
     while True:
-        # Get the list of LDR and temperature/humidity readings from the sensors.
-        val1, val2 = read_ldr_vals(ldr1, ldr2)
-        dht.measure()
-        temp, rel_hum = dht.temperature(), dht.humidity()
-
-        # Temperature value needs to be converted to fahrenheit.
-        temp_f = round((temp * 9.0 / 5.0) + 32.0, 2)
+        # Get the LDR readings and, when it is due, the temperature/humidity readings.
+        val1, val2 = read_ldr1(), read_ldr2()
+        if dht_countdown == 0:
+            measure()
+            temp, rel_hum = temperature(), humidity()
+
+            # Temperature value needs to be converted to fahrenheit. The display limits its
+            # precision.
+            temp_f = temp * 1.8 + 32.0
+            dht_countdown = dht_interval
+        dht_countdown -= 1
 
         # Calculate the average, raw delta, and percent delta values for the readings and check
         # the data's validity.
-        avg_val = calculate_average_val(val1, val2)
-        delta = calculate_delta(val1, val2)
-        perc_delta = calculate_percent_delta(val1, val2, avg_val, delta)
-        is_valid = is_data_valid(perc_delta, max_perc_delta)
+        avg_val, delta, perc_delta, is_valid = process(val1, val2, max_perc_delta)
 
         # Output data to the console if verbose output was requested.
         if verbose_output:
             print_data(val1, val2, delta, perc_delta)
 
         # Alert the second thread that the reading indicator needs to be lit. Then, update the
-        # display and sleep until the next reading.
-        RunCoreFlag.set_run_flag()
-        display.update(val1, val2, avg_val, delta, perc_delta, is_valid, temp_f, rel_hum)
-        sleep_ms(reading_delay_ms)
+        # display, sleep until the next reading, and clean up this reading's garbage.
+        if run_core_locked():
+            release_run_core()
+        update_display(val1, val2, avg_val, delta, perc_delta, is_valid, temp_f, rel_hum)
+        sleep(reading_delay_ms)
+        collect()
 
 
 def core1_thread():
-    """ Manages the indication that a reading has taken place by polling the RunCoreFlag. """
-
-    global run_core
-    global indicator_ontime_ms
+    """ Manages the indication that a reading has taken place by waiting on the run core lock. """
 
     # Setup the LED used to indicate a reading has been taken. This program uses the onboard LED.
-    reading_indicator = Pin(25, Pin.OUT)
-
-    # RunCoreFlag may not be defined yet if this thread starts before data thread.
-    # Try sleeping for 0.1s to see if it is, then try again.
-    try:
-        RunCoreFlag.get_run_flag()
-    except NameError:
-        sleep_ms(0.1)
+    reading_indicator = Pin(_LED_PIN, Pin.OUT)
 
     # Loop until device loses power.
     while True:
-        # Wait for core 0 to signal start.
-        while not RunCoreFlag.get_run_flag():
-            pass
+        # Sleep until core 0 signals start. Acquiring the lock also resets it for the next reading.
+        run_core_lock.acquire()
 
         # Light the indicator LED, sleep for the set delay and then shut it off.
         reading_indicator.on()
-        sleep_ms(indicator_ontime_ms)
+        sleep_ms(_LED_ON_MS)
         reading_indicator.off()
 
-        # Clear the run flag indicating this core has finished its task.
-        RunCoreFlag.clear_run_flag()
-
 
 def main():
     """ Main entrypoint of the file. """
 
-    # Adjust the delay between readings and indicator LED ontime (both in ms). Don't go below 1000.
-    reading_delay_ms = 15000
-
-    global indicator_ontime_ms
-    indicator_ontime_ms = 125
+    # Set the CPU clock. This must happen before the display's I2C bus is set up so that its clock
+    # divider is calculated from the new frequency.
+    freq(_CPU_FREQ)
 
     # Set console output here. True = output, False = no output. Primarily used for debugging.
     console_output = False
@@ -246,12 +217,12 @@ def main():
     max_perc_delta = 25.0
 
     try:
-        # Clear the run flag as a precaution.
-        RunCoreFlag.clear_run_flag()
+        # Make sure the run core lock is held as a precaution.
+        run_core_lock.acquire(0)
 
         # Create and start the reading indication thread, then start the data thread.
         second_thread = start_new_thread(core1_thread, ())
-        core0_thread(reading_delay_ms, max_perc_delta, console_output)
+        core0_thread(_READ_DELAY_MS, max_perc_delta, console_output)
     except KeyboardInterrupt:
         exit(0)
 